@@ -2,10 +2,13 @@
 @author jacobi petrucciani
 @desc qoo module
 """
-import boto3
 import os
+from qoo.consumer import AutoscalingConsumer, ScalingDecision  # noqa
+from qoo.dedup import DedupCache, SQLiteDedupCache  # noqa
 from qoo.errors import FailedToCreateQueue
+from qoo.metrics import LagTracker, Sketch  # noqa
 from qoo.queues import Job, Queue  # noqa
+from qoo.routing import Router  # noqa
 from typing import Any, List
 
 
@@ -18,7 +21,10 @@ def _client(region: str = "") -> Any:
     @desc generate a boto3 sqs client
     @arg region: the AWS region to connect to
     @ret a boto3 sqs client
+    @note boto3 is imported here so that importing qoo stays fast
     """
+    import boto3
+
     region_name = region or os.environ.get("AWS_DEFAULT_REGION", AWS_DEFAULT_REGION)
     return boto3.client("sqs", region_name=region_name)
 
@@ -0,0 +1,9 @@
+"""
+@author jacobi petrucciani
+@desc allow running the qoo cli with python -m qoo
+"""
+import sys
+from qoo.cli import main
+
+
+sys.exit(main())
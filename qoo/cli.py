@@ -0,0 +1,266 @@
+"""
+@author jacobi petrucciani
+@desc qoo command line tool for bulk operations and live stats
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from qoo.queues import MAX_BATCH_BYTES, MAX_MESSAGES, Queue
+from qoo.utils import ichunk
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+
+CLEAR_SCREEN = "\033[2J\033[H"
+STATS_FORMAT = "{:<40} {:>12} {:>12} {:>12}"
+
+
+def _get(args: argparse.Namespace, queue_name: str) -> Queue:
+    """
+    @cc 1
+    @desc get a qoo Queue object using the global cli options
+    @arg args: the parsed cli arguments
+    @arg queue_name: the name of the queue to get
+    @ret a qoo Queue object
+    """
+    return Queue(queue_name, region_name=args.region)
+
+
+def _lines(stream: IO) -> Iterator[Tuple[int, str]]:
+    """
+    @cc 3
+    @desc lazily yield the non-empty lines of an ndjson stream, with their line numbers
+    @arg stream: the file-like object to read from
+    @ret an iterator of line numbers and json encoded message bodies
+    """
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if line:
+            yield number, line
+
+
+def _entries(batch: List[Tuple[int, str]], delay_seconds: int) -> List[Dict]:
+    """
+    @cc 1
+    @desc build send_batch entries for numbered lines, using the line numbers as ids
+    @arg batch: the numbered lines to send
+    @arg delay_seconds: the delay for each message
+    @ret a list of SQS batch entries
+    """
+    return [
+        {"Id": str(number), "MessageBody": line, "DelaySeconds": delay_seconds}
+        for number, line in batch
+    ]
+
+
+def _collect(future: Future, batch: List[Tuple[int, str]]) -> Tuple[int, int]:
+    """
+    @cc 3
+    @desc report the outcome of one batch send, treating a failed call as all entries failing
+    @arg future: the future of the send_batch call
+    @arg batch: the numbered lines that were sent in this batch
+    @ret the number of sent and failed messages
+    @note failures are printed to stderr as they are collected, by line number
+    """
+    try:
+        response = future.result()
+    except Exception as error:
+        for number, _ in batch:
+            print("failed: line {}: {!r}".format(number, error), file=sys.stderr)
+        return 0, len(batch)
+    for failure in response[Queue.FAILED]:
+        print(
+            "failed: line {}: {}: {}".format(
+                failure["Id"], failure.get("Code"), failure.get("Message")
+            ),
+            file=sys.stderr,
+        )
+    return len(response[Queue.SUCCESS]), len(response[Queue.FAILED])
+
+
+def send(args: argparse.Namespace) -> int:
+    """
+    @cc 6
+    @desc stream ndjson into the queue through batched, concurrent sends
+    @arg args: the parsed cli arguments
+    @ret the exit code, 1 if any messages failed to send
+    @note batches hold up to 10 lines and 256 KiB, and only concurrency * 2 batches
+        are held in memory at any one time
+    """
+    queue = _get(args, args.queue)
+    stream = sys.stdin if args.file == "-" else open(args.file)
+    sent = 0
+    failed = 0
+    batches = ichunk(
+        _lines(stream),
+        size=MAX_MESSAGES,
+        max_bytes=MAX_BATCH_BYTES,
+        measure=lambda x: len(x[1].encode("utf-8")),
+    )
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            pending = {}  # type: Dict[Future, List[Tuple[int, str]]]
+            for batch in batches:
+                if len(pending) >= args.concurrency * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        counts = _collect(future, pending.pop(future))
+                        sent, failed = sent + counts[0], failed + counts[1]
+                future = executor.submit(
+                    queue.send_batch,
+                    _entries(batch, args.delay_seconds),
+                    auto_metadata=False,
+                )
+                pending[future] = batch
+            for future, batch in pending.items():
+                counts = _collect(future, batch)
+                sent, failed = sent + counts[0], failed + counts[1]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    print("sent {} messages, {} failed".format(sent, failed), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def tail(args: argparse.Namespace) -> int:
+    """
+    @cc 6
+    @desc print message bodies as they are received, optionally deleting them
+    @arg args: the parsed cli arguments
+    @ret the exit code
+    """
+    queue = _get(args, args.queue)
+    received = 0
+    while not args.count or received < args.count:
+        max_messages = MAX_MESSAGES
+        if args.count:
+            max_messages = min(MAX_MESSAGES, args.count - received)
+        jobs = queue.receive_jobs(max_messages=max_messages, wait_time=args.wait)
+        if not jobs and args.exit_when_empty:
+            break
+        for job in jobs:
+            print(job._data["Body"], flush=True)
+            if args.delete:
+                job.delete()
+        received += len(jobs)
+    return 0
+
+
+def stats(args: argparse.Namespace) -> int:
+    """
+    @cc 5
+    @desc print refreshing backlog and in-flight counters for one or many queues
+    @arg args: the parsed cli arguments
+    @ret the exit code
+    """
+    queues = [_get(args, x) for x in args.queues]
+    refreshes = 0
+    while True:
+        if sys.stdout.isatty():
+            print(CLEAR_SCREEN, end="")
+        print(STATS_FORMAT.format("queue", "messages", "in_flight", "delayed"))
+        for queue in queues:
+            queue._update_attributes()
+            print(
+                STATS_FORMAT.format(
+                    queue.name,
+                    queue.approx_messages,
+                    queue.approx_not_visible,
+                    queue.approx_delayed,
+                )
+            )
+        sys.stdout.flush()
+        refreshes += 1
+        if args.count and refreshes >= args.count:
+            return 0
+        time.sleep(args.interval)
+
+
+def purge(args: argparse.Namespace) -> int:
+    """
+    @cc 3
+    @desc purge all messages from a queue, after confirmation
+    @arg args: the parsed cli arguments
+    @ret the exit code, 1 if the purge was not confirmed
+    """
+    queue = _get(args, args.queue)
+    if not args.yes:
+        answer = input("purge all messages from {}? [y/N] ".format(queue.name))
+        if answer.strip().lower() not in ("y", "yes"):
+            print("aborted", file=sys.stderr)
+            return 1
+    queue.purge()
+    return 0
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    @cc 1
+    @desc build the argument parser for the qoo cli
+    @ret an argument parser with a subcommand for each operation
+    """
+    root = argparse.ArgumentParser(prog="qoo", description="bulk operations for SQS")
+    root.add_argument("--region", default="", help="the AWS region of the queues")
+    commands = root.add_subparsers(dest="command")
+    commands.required = True
+
+    send_parser = commands.add_parser("send", help="send ndjson messages to a queue")
+    send_parser.add_argument("queue", help="the queue to send to")
+    send_parser.add_argument(
+        "file", nargs="?", default="-", help="ndjson file to send, default stdin"
+    )
+    send_parser.add_argument(
+        "-c", "--concurrency", type=int, default=8, help="concurrent batch sends"
+    )
+    send_parser.add_argument(
+        "--delay-seconds", type=int, default=0, help="delay for each message"
+    )
+    send_parser.set_defaults(func=send)
+
+    tail_parser = commands.add_parser("tail", help="print messages from a queue")
+    tail_parser.add_argument("queue", help="the queue to receive from")
+    tail_parser.add_argument(
+        "-n", "--count", type=int, default=0, help="stop after this many messages"
+    )
+    tail_parser.add_argument(
+        "-d", "--delete", action="store_true", help="delete messages once printed"
+    )
+    tail_parser.add_argument(
+        "-w", "--wait", type=int, default=10, help="long-poll wait time in seconds"
+    )
+    tail_parser.add_argument(
+        "--exit-when-empty", action="store_true", help="stop on an empty receive"
+    )
+    tail_parser.set_defaults(func=tail)
+
+    stats_parser = commands.add_parser("stats", help="show live queue counters")
+    stats_parser.add_argument("queues", nargs="+", help="the queues to watch")
+    stats_parser.add_argument(
+        "-i", "--interval", type=float, default=5.0, help="seconds between refreshes"
+    )
+    stats_parser.add_argument(
+        "-n", "--count", type=int, default=0, help="stop after this many refreshes"
+    )
+    stats_parser.set_defaults(func=stats)
+
+    purge_parser = commands.add_parser("purge", help="purge all messages from a queue")
+    purge_parser.add_argument("queue", help="the queue to purge")
+    purge_parser.add_argument(
+        "-y", "--yes", action="store_true", help="skip the confirmation prompt"
+    )
+    purge_parser.set_defaults(func=purge)
+    return root
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    @cc 2
+    @desc run the qoo cli
+    @arg argv: the cli arguments, defaulting to sys.argv
+    @ret the exit code
+    """
+    args = parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        return 130
@@ -0,0 +1,317 @@
+"""
+@author jacobi petrucciani
+@desc backlog-driven autoscaling of local consumer worker threads
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from qoo.queues import MAX_MESSAGES, Job, Queue
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+
+LOG = logging.getLogger(__name__)
+EWMA_ALPHA = 0.2
+MAX_DECISIONS = 100
+
+ScalingDecision = NamedTuple(
+    "ScalingDecision",
+    [("at", float), ("previous", int), ("scale", int), ("reason", str)],
+)
+
+
+class AutoscalingConsumer:
+    """
+    @desc consume a queue with a pool of worker threads, sized by the queue's backlog
+    """
+
+    def __init__(
+        self,
+        queue: Queue,
+        handler: Callable[[Job], Any],
+        min_workers: int = 1,
+        max_workers: int = 10,
+        target_drain_time: float = 60.0,
+        interval: float = 10.0,
+        scale_up_cooldown: float = 30.0,
+        scale_down_cooldown: float = 120.0,
+        hysteresis: float = 0.25,
+    ) -> None:
+        """
+        @cc 2
+        @desc autoscaling consumer constructor
+        @arg queue: the qoo Queue to consume
+        @arg handler: the callable to pass each job to
+        @arg min_workers: the min number of worker threads
+        @arg max_workers: the max number of worker threads
+        @arg target_drain_time: the number of seconds the backlog should be worked through in
+        @arg interval: the number of seconds between scaling checks
+        @arg scale_up_cooldown: the min seconds after a scaling change before scaling up
+        @arg scale_down_cooldown: the min seconds after a scaling change before scaling down
+        @arg hysteresis: the fraction the desired scale must fall below the current one
+            before scaling down, to avoid flapping
+        @note jobs are deleted after the handler returns, unless it already deleted the job
+            or returned False; jobs whose handler raises are left to be redelivered
+        """
+        if not 0 <= min_workers <= max_workers:
+            raise ValueError("min_workers must be between 0 and max_workers")
+        self.queue = queue
+        self.handler = handler
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_drain_time = target_drain_time
+        self.interval = interval
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.hysteresis = hysteresis
+        self.decisions = deque(maxlen=MAX_DECISIONS)  # type: deque
+        self.reason = "not started"
+        self.processed = 0
+        self.failed = 0
+        self._job_seconds = None  # type: Optional[float]
+        self._in_flight = 0
+        self._last_scaled_at = -math.inf
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._workers = []  # type: List[Tuple[threading.Thread, threading.Event]]
+        self._retired = []  # type: List[threading.Thread]
+        self._controller = None  # type: Optional[threading.Thread]
+
+    def __enter__(self) -> "AutoscalingConsumer":
+        """
+        @cc 1
+        @desc start consuming when used as a context manager
+        @ret this consumer
+        """
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        """
+        @cc 1
+        @desc stop consuming when leaving the context manager
+        """
+        self.stop()
+
+    @property
+    def scale(self) -> int:
+        """
+        @cc 1
+        @desc the current number of worker threads
+        @ret the number of running workers
+        """
+        return len(self._workers)
+
+    @property
+    def last_decision(self) -> Optional[ScalingDecision]:
+        """
+        @cc 2
+        @desc the most recent scaling change
+        @ret the last scaling decision, or none if the scale has not changed yet
+        """
+        return self.decisions[-1] if self.decisions else None
+
+    @property
+    def job_rate(self) -> Optional[float]:
+        """
+        @cc 2
+        @desc the measured number of jobs a single worker can process per second
+        @ret the per-worker job rate, or none if no jobs have been processed yet
+        """
+        if self._job_seconds is None:
+            return None
+        return 1.0 / max(self._job_seconds, 1e-3)
+
+    def start(self) -> None:
+        """
+        @cc 1
+        @desc start the min number of workers and the scaling controller
+        """
+        self._stopping.clear()
+        self._set_scale(self.min_workers, "started with min_workers")
+        self._controller = threading.Thread(
+            target=self._control, name="qoo-autoscaler", daemon=True
+        )
+        self._controller.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        @cc 5
+        @desc stop all workers once their current jobs are finished
+        @arg timeout: the max seconds to wait for each thread to finish
+        @note the controller is joined first, so it cannot start workers during teardown,
+            and workers retired by a scale down are joined as well
+        """
+        self._stopping.set()
+        if self._controller is not None:
+            self._controller.join(timeout)
+        with self._lock:
+            workers = self._workers
+            retired = self._retired
+            self._workers = []
+            self._retired = []
+        for _, stop in workers:
+            stop.set()
+        for thread in [x for x, _ in workers] + retired:
+            thread.join(timeout)
+
+    def run(self) -> None:
+        """
+        @cc 2
+        @desc start consuming and block until interrupted
+        """
+        self.start()
+        try:
+            while not self._stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def evaluate(self) -> Optional[ScalingDecision]:
+        """
+        @cc 3
+        @desc refresh the queue's counters and apply a scaling decision
+        @ret the decision made, which may keep the current scale, or none once stopping
+        """
+        if self._stopping.is_set():
+            return None
+        self.queue._update_attributes()
+        decision = self._decide(
+            self.queue.approx_messages, self.queue.approx_not_visible, time.time()
+        )
+        self.reason = decision.reason
+        if decision.scale != decision.previous:
+            self._set_scale(decision.scale, decision.reason)
+        return decision
+
+    def _decide(self, backlog: int, not_visible: int, now: float) -> ScalingDecision:
+        """
+        @cc 9
+        @desc decide how many workers are needed for the current backlog
+        @arg backlog: the approximate number of visible messages
+        @arg not_visible: the approximate number of in-flight messages
+        @arg now: the current timestamp
+        @ret the scaling decision
+        @note in-flight messages held by this consumer's own workers are not counted as backlog
+        """
+        current = self.scale
+        work = backlog + max(not_visible - self._in_flight, 0)
+        rate = self.job_rate
+        if rate is None:
+            desired = current + 1 if work else current
+            reason = "{} messages waiting, no job rate measured yet".format(work)
+        else:
+            desired = int(math.ceil(work / (rate * self.target_drain_time)))
+            reason = "{} messages waiting at {:.2f} jobs/s per worker".format(
+                work, rate
+            )
+        desired = min(max(desired, self.min_workers), self.max_workers)
+        since = now - self._last_scaled_at
+        if desired > current and since < self.scale_up_cooldown:
+            reason += ", holding at {} in scale up cooldown".format(current)
+            desired = current
+        elif desired < current and desired > current * (1 - self.hysteresis):
+            reason += ", holding at {} within hysteresis".format(current)
+            desired = current
+        elif desired < current and since < self.scale_down_cooldown:
+            reason += ", holding at {} in scale down cooldown".format(current)
+            desired = current
+        elif desired != current:
+            reason += ", scaling to {}".format(desired)
+        else:
+            reason += ", keeping {}".format(current)
+        return ScalingDecision(now, current, desired, reason)
+
+    def _set_scale(self, scale: int, reason: str) -> None:
+        """
+        @cc 4
+        @desc start or stop workers to reach the given scale
+        @arg scale: the number of workers to run
+        @arg reason: why the scale is being changed
+        @note this does nothing once the consumer is stopping
+        """
+        with self._lock:
+            if self._stopping.is_set():
+                return
+            previous = self.scale
+            while self.scale < scale:
+                stop = threading.Event()
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stop,),
+                    name="qoo-worker-{}".format(self.scale),
+                    daemon=True,
+                )
+                self._workers.append((thread, stop))
+                thread.start()
+            self._retired = [x for x in self._retired if x.is_alive()]
+            while self.scale > scale:
+                thread, stop = self._workers.pop()
+                stop.set()
+                self._retired.append(thread)
+            self._last_scaled_at = time.time()
+            self.decisions.append(
+                ScalingDecision(self._last_scaled_at, previous, scale, reason)
+            )
+        LOG.info(
+            "scaled %s from %d to %d workers: %s", self.queue, previous, scale, reason
+        )
+
+    def _control(self) -> None:
+        """
+        @cc 3
+        @desc periodically evaluate the scale until stopped
+        """
+        while not self._stopping.wait(self.interval):
+            try:
+                self.evaluate()
+            except Exception:
+                LOG.exception("failed to evaluate the scale of %s", self.queue)
+
+    def _work(self, stop: threading.Event) -> None:
+        """
+        @cc 3
+        @desc receive and handle jobs until told to stop
+        @arg stop: the event that tells this worker to stop
+        @note a stopped worker finishes the jobs it has already received
+        """
+        while not stop.is_set():
+            try:
+                jobs = self.queue.receive_jobs(max_messages=MAX_MESSAGES)
+            except Exception:
+                LOG.exception("failed to receive jobs from %s", self.queue)
+                stop.wait(1)
+                continue
+            with self._lock:
+                self._in_flight += len(jobs)
+            for job in jobs:
+                self._handle(job)
+
+    def _handle(self, job: Job) -> None:
+        """
+        @cc 4
+        @desc pass a job to the handler, deleting it and measuring the time taken
+        @arg job: the job to handle
+        """
+        started = time.time()
+        try:
+            if self.handler(job) is not False and not job._deleted:
+                job.delete()
+            succeeded = True
+        except Exception:
+            LOG.exception("failed to handle %s", job)
+            succeeded = False
+        elapsed = time.time() - started
+        with self._lock:
+            self._in_flight -= 1
+            if succeeded:
+                self.processed += 1
+            else:
+                self.failed += 1
+            if self._job_seconds is None:
+                self._job_seconds = elapsed
+            else:
+                self._job_seconds += EWMA_ALPHA * (elapsed - self._job_seconds)
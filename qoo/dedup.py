@@ -0,0 +1,229 @@
+"""
+@author jacobi petrucciani
+@desc consumer-side duplicate suppression caches for qoo
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+MESSAGE_ID = "message_id"
+MD5 = "md5"
+KEY_TYPES = (MESSAGE_ID, MD5)
+
+
+class DedupCache:
+    """
+    @desc bounded in-memory LRU + TTL cache of processed job keys
+    """
+
+    def __init__(
+        self, max_size: int = 10000, ttl: float = 3600.0, key: str = MESSAGE_ID
+    ) -> None:
+        """
+        @cc 2
+        @desc dedup cache constructor
+        @arg max_size: the max number of keys to remember before evicting the oldest
+        @arg ttl: the number of seconds a processed key is remembered for
+        @arg key: what to identify jobs by, either "message_id" or "md5" of the body
+        """
+        if key not in KEY_TYPES:
+            raise ValueError("key must be one of {}".format(", ".join(KEY_TYPES)))
+        self.max_size = max_size
+        self.ttl = ttl
+        self.key = key
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # type: OrderedDict
+
+    def __contains__(self, key: str) -> bool:
+        """
+        @cc 3
+        @desc check if the given key has been processed and is not yet expired
+        @arg key: the job key to check for
+        @ret true if the key has been processed within the ttl
+        """
+        with self._lock:
+            processed_at = self._entries.get(key)
+            if processed_at is None:
+                return False
+            if time.time() - processed_at > self.ttl:
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def __len__(self) -> int:
+        """
+        @cc 1
+        @desc the number of keys currently held in the cache
+        @ret the number of cached keys, which may include expired ones
+        """
+        return len(self._entries)
+
+    def key_for(self, job: Any) -> str:
+        """
+        @cc 2
+        @desc get the key this cache uses to identify the given job
+        @arg job: the qoo Job to get a key for
+        @ret the job's message id or body md5
+        """
+        return job._md5 if self.key == MD5 else job._id
+
+    def seen(self, job: Any) -> bool:
+        """
+        @cc 1
+        @desc check if the given job has already been processed
+        @arg job: the qoo Job to check
+        @ret true if this job is a duplicate of an already processed job
+        """
+        return self.key_for(job) in self
+
+    def add(self, job: Any) -> None:
+        """
+        @cc 1
+        @desc mark the given job as processed
+        @arg job: the qoo Job that has been processed
+        """
+        self.add_key(self.key_for(job))
+
+    def add_key(self, key: str) -> None:
+        """
+        @cc 2
+        @desc mark the given key as processed, evicting the oldest keys if full
+        @arg key: the job key to remember
+        """
+        with self._lock:
+            self._entries[key] = time.time()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        @cc 1
+        @desc forget all processed keys
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteDedupCache(DedupCache):
+    """
+    @desc bounded TTL cache of processed job keys, shareable across processes,
+        evicting the least recently added keys
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 100000,
+        ttl: float = 3600.0,
+        key: str = MESSAGE_ID,
+        timeout: float = 5.0,
+    ) -> None:
+        """
+        @cc 1
+        @desc sqlite dedup cache constructor
+        @arg path: the path to the sqlite database file shared by the processes on this node
+        @arg max_size: the max number of keys to remember before evicting the oldest
+        @arg ttl: the number of seconds a processed key is remembered for
+        @arg key: what to identify jobs by, either "message_id" or "md5" of the body
+        @arg timeout: how long to wait on a locked database before failing
+        """
+        DedupCache.__init__(self, max_size=max_size, ttl=ttl, key=key)
+        self.path = path
+        self._prune_every = max(1, max_size // 10)
+        self._adds = 0
+        self._db = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS qoo_processed "
+            "(key TEXT PRIMARY KEY, processed_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS qoo_processed_at ON qoo_processed (processed_at)"
+        )
+
+    def __contains__(self, key: str) -> bool:
+        """
+        @cc 1
+        @desc check if the given key has been processed and is not yet expired
+        @arg key: the job key to check for
+        @ret true if the key has been processed within the ttl
+        @note this is read-only so lookups never take the database write lock;
+            recency is only refreshed by add_key
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM qoo_processed WHERE key = ? AND processed_at >= ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+            return row is not None
+
+    def __len__(self) -> int:
+        """
+        @cc 1
+        @desc the number of keys currently held in the cache
+        @ret the number of cached keys, which may include expired ones
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM qoo_processed").fetchone()[0]
+
+    def add_key(self, key: str) -> None:
+        """
+        @cc 2
+        @desc mark the given key as processed, periodically evicting expired and oldest keys
+        @arg key: the job key to remember
+        @note eviction runs every max_size / 10 adds, so the table may briefly exceed max_size
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO qoo_processed (key, processed_at) VALUES (?, ?)",
+                (key, now),
+            )
+            self._adds += 1
+            if self._adds >= self._prune_every:
+                self._adds = 0
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        """
+        @cc 2
+        @desc evict expired keys, then the oldest keys beyond max_size
+        @arg now: the current timestamp
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute(
+                "DELETE FROM qoo_processed WHERE processed_at < ?", (now - self.ttl,)
+            )
+            # rowid breaks ties between keys added within the same clock tick
+            self._db.execute(
+                "DELETE FROM qoo_processed WHERE rowid IN (SELECT rowid FROM qoo_processed "
+                "ORDER BY processed_at DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            )
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def clear(self) -> None:
+        """
+        @cc 1
+        @desc forget all processed keys
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM qoo_processed")
+
+    def close(self) -> None:
+        """
+        @cc 1
+        @desc close the underlying sqlite connection
+        """
+        self._db.close()
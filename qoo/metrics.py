@@ -0,0 +1,209 @@
+"""
+@author jacobi petrucciani
+@desc bounded-memory latency tracking for qoo queues
+"""
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+MIN_VALUE = 1e-9
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+
+class Sketch:
+    """
+    @desc streaming quantile sketch with log-spaced buckets and bounded memory
+    """
+
+    def __init__(
+        self, relative_accuracy: float = 0.01, max_buckets: int = 2048
+    ) -> None:
+        """
+        @cc 1
+        @desc sketch constructor
+        @arg relative_accuracy: the relative error of the estimated quantiles
+        @arg max_buckets: the max buckets to keep, collapsing the lowest ones when exceeded
+        """
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._buckets = {}  # type: Dict[int, int]
+        self._zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self) -> int:
+        """
+        @cc 1
+        @desc the number of values added to this sketch
+        @ret the count of values
+        """
+        return self.count
+
+    def add(self, value: float) -> None:
+        """
+        @cc 3
+        @desc add a value to the sketch
+        @arg value: the value to add, values below zero are counted as zero
+        """
+        value = max(value, 0.0)
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value < MIN_VALUE:
+            self._zeros += 1
+            return
+        index = int(math.ceil(math.log(value) / self._log_gamma))
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        if len(self._buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        """
+        @cc 1
+        @desc merge the lowest bucket into the next lowest, keeping the bucket count bounded
+        @note this only loses accuracy for the smallest values, keeping the tail accurate
+        """
+        lowest = self._buckets.pop(min(self._buckets))
+        self._buckets[min(self._buckets)] += lowest
+
+    def quantile(self, quantile: float) -> float:
+        """
+        @cc 5
+        @desc estimate the value at the given quantile
+        @arg quantile: the quantile to estimate, between 0 and 1
+        @ret the estimated value, or nan if the sketch is empty
+        """
+        if not self.count:
+            return math.nan
+        rank = quantile * (self.count - 1)
+        seen = self._zeros
+        if rank < seen:
+            return self.min
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if rank < seen:
+                estimate = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        @cc 2
+        @desc summarize this sketch
+        @ret a dict of the count, mean, min, max, and common percentiles
+        """
+        if not self.count:
+            return {"count": 0}
+        summary = {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+        }  # type: Dict[str, Any]
+        for name, quantile in QUANTILES:
+            summary[name] = self.quantile(quantile)
+        return summary
+
+
+class LagTracker:
+    """
+    @desc tracks queueing delay, processing time, and redeliveries for a queue
+    """
+
+    def __init__(
+        self, relative_accuracy: float = 0.01, max_buckets: int = 2048
+    ) -> None:
+        """
+        @cc 1
+        @desc lag tracker constructor
+        @arg relative_accuracy: the relative error of the estimated percentiles
+        @arg max_buckets: the max buckets to keep in each sketch
+        """
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        @cc 1
+        @desc clear all recorded measurements
+        """
+        with self._lock:
+            self.receive_latency = Sketch(self.relative_accuracy, self.max_buckets)
+            self.processing_time = Sketch(self.relative_accuracy, self.max_buckets)
+            self.receive_counts = Sketch(self.relative_accuracy, self.max_buckets)
+            self.redelivered = 0
+            self.started_at = time.time()
+            self.oldest_message_age = None  # type: Optional[float]
+            self.oldest_message_seen_at = None  # type: Optional[float]
+
+    def record_receive(self, job: Any) -> None:
+        """
+        @cc 1
+        @desc record the send to receive latency and receive count of a received job
+        @arg job: the qoo Job that was just received
+        """
+        with self._lock:
+            self._record_receive(job)
+
+    def _record_receive(self, job: Any) -> None:
+        """
+        @cc 2
+        @desc record a received job, with the lock already held
+        @arg job: the qoo Job that was just received
+        """
+        self.receive_latency.add(job.elapsed)
+        self.receive_counts.add(job.approximate_receive_count)
+        if job.approximate_receive_count > 1:
+            self.redelivered += 1
+
+    def record_batch(self, jobs: List[Any]) -> None:
+        """
+        @cc 3
+        @desc record a batch of received jobs, updating the oldest message age gauge
+        @arg jobs: the qoo Jobs returned by a single receive, which may be empty
+        @note an empty receive means no messages were waiting, so the gauge drops to 0
+        """
+        with self._lock:
+            for job in jobs:
+                self._record_receive(job)
+            self.oldest_message_age = max([x.elapsed for x in jobs] + [0.0])
+            self.oldest_message_seen_at = time.time()
+
+    def record_delete(self, job: Any) -> None:
+        """
+        @cc 1
+        @desc record the receive to delete processing time of a job
+        @arg job: the qoo Job that was just deleted
+        """
+        with self._lock:
+            self.processing_time.add(time.time() - job._received_at)
+
+    def report(self) -> Dict[str, Any]:
+        """
+        @cc 1
+        @desc summarize the recorded measurements
+        @ret a dict of latency summaries, in seconds, and counters
+        @note oldest_message_age is the age of the oldest message in the most recent
+            receive, as of oldest_message_seen_at
+        """
+        with self._lock:
+            return {
+                "since": self.started_at,
+                "received": self.receive_latency.count,
+                "deleted": self.processing_time.count,
+                "redelivered": self.redelivered,
+                "oldest_message_age": self.oldest_message_age,
+                "oldest_message_seen_at": self.oldest_message_seen_at,
+                "receive_latency": self.receive_latency.summary(),
+                "processing_time": self.processing_time.summary(),
+                "receive_count": self.receive_counts.summary(),
+            }
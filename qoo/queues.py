@@ -2,16 +2,27 @@
 @author jacobi petrucciani
 @desc qoo queue and job class
 """
-import boto3
+import logging
 import os
 import time
 import hashlib
 import json
-from qoo.utils import chunk, jsond, jsonl, new_uuid
-from typing import Dict, List, Optional, Union
+from qoo.dedup import DedupCache
+from qoo.metrics import LagTracker
+from qoo.utils import (
+    chunk,
+    decode_message_attributes,
+    encode_message_attributes,
+    jsond,
+    jsonl,
+    new_uuid,
+)
+from typing import Any, Dict, List, Mapping, Optional, Union
 
 
+LOG = logging.getLogger(__name__)
 MAX_MESSAGES = 10
+MAX_BATCH_BYTES = 262144
 
 
 class Job:
@@ -21,21 +32,21 @@ class Job:
 
     def __init__(self, sqs_message: dict, queue: "Queue") -> None:
         """
-        @cc 2
+        @cc 1
         @desc job constructor
         @arg sqs_message: the dictionary of values to pass as a message
         @arg queue: the queue this message will be sent in
+        @note the body is only decoded once one of its keys is accessed
         """
         self._queue = queue
         self._data = sqs_message
+        self._decoded = False
+        self._deleted = False
         self._md5 = self._data["MD5OfBody"]
         self._id = self._data["MessageId"]
-        try:
-            self._body = jsonl(self._data["Body"])
-            for key in self._body:
-                setattr(self, key, self._body[key])
-        except json.decoder.JSONDecodeError:
-            self._body = self._data["Body"]
+        self.message_attributes = decode_message_attributes(
+            self._data.get("MessageAttributes", {})
+        )
         self._attributes = self._data["Attributes"]
         self._sent_at = float(self._attributes["SentTimestamp"]) / 1000
         self._received_at = float(time.time())
@@ -45,15 +56,46 @@ class Job:
         )
         self._handle = self._data["ReceiptHandle"]
 
+    def __getattr__(self, name: str) -> Any:
+        """
+        @cc 3
+        @desc decode the body on first access of a missing attribute, then look it up
+        @arg name: the name of the attribute to get
+        @ret the value of the attribute from the job's body
+        """
+        if name.startswith("__") or self.__dict__.get("_decoded", True):
+            raise AttributeError(name)
+        self._decode()
+        return getattr(self, name)
+
     def __contains__(self, key: str) -> bool:
         """
-        @cc 1
+        @cc 2
         @desc check if the given key exists in this job
         @arg key: a key to check for in this job's attributes
         @ret true if the job contains this key
         """
+        if not self._decoded:
+            self._decode()
         return key in dir(self)
 
+    def _decode(self) -> None:
+        """
+        @cc 5
+        @desc decode the json body, setting each of its keys as attributes on this job
+        @note keys that clash with the job's own attributes or methods are not set,
+            they are still available in the decoded _body
+        """
+        self._decoded = True
+        try:
+            self._body = jsonl(self._data["Body"])
+            if isinstance(self._body, Mapping):
+                for key in self._body:
+                    if key not in self.__dict__ and not hasattr(Job, key):
+                        setattr(self, key, self._body[key])
+        except json.decoder.JSONDecodeError:
+            self._body = self._data["Body"]
+
     def __eq__(self, other: object) -> bool:
         """
         @cc 1
@@ -81,11 +123,16 @@ class Job:
 
     def delete(self) -> Dict:
         """
-        @cc 1
-        @desc delete this object
+        @cc 2
+        @desc delete this object, marking it as processed in the queue's dedup cache
         @ret the AWS response for deleting this message
         """
-        return self._queue.delete_job(self._handle)
+        response = self._queue.delete_job(self._handle)
+        self._deleted = True
+        self._queue._lag.record_delete(self)
+        if self._queue._dedup is not None:
+            self._queue._dedup.add(self)
+        return response
 
     @property
     def md5_matches(self) -> bool:
@@ -115,6 +162,7 @@ class Queue:
         max_messages: int = 1,
         wait_time: int = 10,
         async_send: bool = False,
+        dedup: Optional[DedupCache] = None,
     ) -> None:
         """
         @cc 4
@@ -126,11 +174,14 @@ class Queue:
         @arg max_messages: the max messages to pull at each time
         @arg wait_time: the default wait time for receives
         @arg async_send: whether or not to send async TODO
+        @arg dedup: an optional cache of processed jobs, used to ack and skip redeliveries
         """
         self.name = name
         self._max_messages = max_messages
         self._wait_time = wait_time
         self._async = async_send
+        self._dedup = dedup
+        self._lag = LagTracker()
         self._region_name = region_name or os.environ.get("AWS_DEFAULT_REGION")
         self._aws_access_key_id = aws_access_key_id or os.environ.get(
             "AWS_ACCESS_KEY_ID"
@@ -147,6 +198,9 @@ class Queue:
         if self._region_name:
             client_args["region_name"] = self._region_name
 
+        # boto3 is slow to import, so only load it once a client is actually needed
+        import boto3
+
         self._client = boto3.client("sqs", **client_args)
         self._region_name = self._client._client_config.region_name
         self._queue_url = self._client.get_queue_url(QueueName=self.name)["QueueUrl"]
@@ -213,15 +267,21 @@ class Queue:
         """
         return self.send_job(**attributes)
 
-    def send_job(self, **attributes) -> str:
+    def send_job(
+        self, message_attributes: Optional[Mapping] = None, **attributes
+    ) -> str:
         """
-        @cc 1
+        @cc 2
         @desc using the kwarg attributes, send a job to this queue.
+        @arg message_attributes: optional SQS message attributes, see encode_message_attributes
         @ret the AWS response for sending this job
         pass job attributes to set the message/job body
         """
+        extra = {}
+        if message_attributes:
+            extra["MessageAttributes"] = encode_message_attributes(message_attributes)
         response = self._client.send_message(
-            MessageBody=jsond(attributes), QueueUrl=self._queue_url
+            MessageBody=jsond(attributes), QueueUrl=self._queue_url, **extra
         )
         return response["MessageId"]
 
@@ -230,29 +290,48 @@ class Queue:
         raw_jobs: List[Union[Dict, str]],
         delay_seconds: int = 0,
         auto_metadata: bool = True,
+        message_attributes: Optional[Mapping] = None,
     ) -> Dict:
         """
-        @cc 3
+        @cc 5
         @desc send a batch of jobs to the queue, chunked into 10s
         @arg raw_jobs: a list of dicts or json encoded strings
         @arg delay_seconds: a number of seconds to delay sending
         @arg auto_metadata: whether or not to auto-add required metadata to each job
+        @arg message_attributes: optional SQS message attributes to set on every job
         @ret the AWS response for sending these jobs
+        @note without auto_metadata, message_attributes are merged into each entry's own
+            MessageAttributes, with the entry's attributes taking precedence
         """
         jobs = raw_jobs
         successful = []  # type: List
         failed = []  # type: List
+        encoded = (
+            encode_message_attributes(message_attributes) if message_attributes else {}
+        )
 
         # if default, treat each list item as just the message body
         if auto_metadata:
+            extra = {"MessageAttributes": encoded} if encoded else {}
             jobs = [
                 {
                     "Id": new_uuid(),
                     "MessageBody": x if isinstance(x, str) else jsond(x),
                     "DelaySeconds": delay_seconds,
+                    **extra
                 }
                 for x in raw_jobs
             ]
+        elif encoded:
+            jobs = [
+                dict(
+                    x,  # type: ignore
+                    MessageAttributes=dict(
+                        encoded, **x.get("MessageAttributes", {})  # type: ignore
+                    ),
+                )
+                for x in raw_jobs
+            ]
 
         # send in batches of 10
         for job_batch in chunk(jobs, size=MAX_MESSAGES):
@@ -272,6 +351,7 @@ class Queue:
         max_messages: int = None,
         wait_time: int = None,
         attribute_names: str = "All",
+        message_attribute_names: str = "All",
     ) -> List[Job]:
         """
         @cc 2
@@ -279,8 +359,10 @@ class Queue:
         @arg max_messages: the limit to the number of messages to pull
         @arg wait_time: the amount of time to wait before returning
         @arg attribute_names: the attributes to return for each job, default All
+        @arg message_attribute_names: the message attributes to return for each job, default All
         @ret a list of jobs from the queue
         @note this can return with an empty list!
+        @note if this queue has a dedup cache, already processed jobs are deleted and skipped
         """
         num_messages = max_messages if max_messages else self._max_messages
         jobs = self._client.receive_message(
@@ -288,10 +370,33 @@ class Queue:
             MaxNumberOfMessages=num_messages,
             WaitTimeSeconds=wait_time if wait_time else self._wait_time,
             AttributeNames=[attribute_names],
+            MessageAttributeNames=[message_attribute_names],
         )
-        if "Messages" not in jobs:
-            return []
-        return [Job(x, self) for x in jobs["Messages"]]
+        received = [Job(x, self) for x in jobs.get("Messages", [])]
+        self._lag.record_batch(received)
+        return self._drop_duplicates(received)
+
+    def _drop_duplicates(self, jobs: List[Job]) -> List[Job]:
+        """
+        @cc 5
+        @desc delete and filter out any jobs that the dedup cache has already seen processed
+        @arg jobs: the freshly received jobs
+        @ret the jobs that have not been processed yet
+        @note a duplicate that fails to delete is still skipped; SQS will redeliver it
+            and the cache will catch it again
+        """
+        if self._dedup is None:
+            return jobs
+        fresh = []
+        for job in jobs:
+            if not self._dedup.seen(job):
+                fresh.append(job)
+                continue
+            try:
+                self.delete_job(job._handle)
+            except Exception:
+                LOG.exception("failed to delete duplicate %s", job)
+        return fresh
 
     def receive(self, wait_time: int = None) -> Optional[Job]:
         """
@@ -314,6 +419,22 @@ class Queue:
             QueueUrl=self._queue_url, ReceiptHandle=handle
         )
 
+    def latency_report(self) -> Dict:
+        """
+        @cc 1
+        @desc summarize the lag of jobs received and deleted through this queue object
+        @ret a dict of send to receive latency, receive to delete processing time, and
+            receive count summaries with p50/p90/p99 percentiles, all times in seconds
+        """
+        return self._lag.report()
+
+    def reset_latency(self) -> None:
+        """
+        @cc 1
+        @desc clear the lag measurements of this queue object
+        """
+        self._lag.reset()
+
     def purge(self) -> None:
         """
         @cc 1
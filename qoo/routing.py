@@ -0,0 +1,147 @@
+"""
+@author jacobi petrucciani
+@desc route jobs to handlers using only their message attributes
+"""
+import logging
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+
+LOG = logging.getLogger(__name__)
+Route = NamedTuple(
+    "Route", [("handler", Callable), ("predicate", Optional[Callable]), ("match", Dict)]
+)
+
+
+class Router:
+    """
+    @desc dispatch or skip jobs based on their message attributes, without decoding bodies
+    """
+
+    def __init__(self, auto_delete: bool = True, drop_unmatched: bool = False) -> None:
+        """
+        @cc 1
+        @desc router constructor
+        @arg auto_delete: whether to delete jobs once their handler returns without raising
+        @arg drop_unmatched: whether to delete jobs that no route matches, instead of leaving them
+        """
+        self.auto_delete = auto_delete
+        self.drop_unmatched = drop_unmatched
+        self.routes = []  # type: List[Route]
+
+    def add(
+        self,
+        handler: Callable,
+        match: Optional[Dict] = None,
+        predicate: Optional[Callable] = None,
+    ) -> None:
+        """
+        @cc 2
+        @desc add a route, checked in the order that routes were added
+        @arg handler: the callable to pass matching jobs to
+        @arg match: a dict of attribute names to the values to match; tuples, lists and
+            sets match any of their values
+        @arg predicate: an optional callable taking the job's message attributes
+        @note a route with no predicate or match will match every job
+        """
+        self.routes.append(Route(handler, predicate, dict(match or {})))
+
+    def route(
+        self, match: Optional[Dict] = None, predicate: Optional[Callable] = None
+    ) -> Callable:
+        """
+        @cc 1
+        @desc decorator version of add
+        @arg match: a dict of attribute names to the values to match; tuples, lists and
+            sets match any of their values
+        @arg predicate: an optional callable taking the job's message attributes
+        @ret a decorator that registers the handler and returns it unchanged
+        """
+
+        def decorator(handler: Callable) -> Callable:
+            """
+            @cc 1
+            @desc register the decorated handler
+            @arg handler: the callable to pass matching jobs to
+            @ret the handler
+            """
+            self.add(handler, match, predicate)
+            return handler
+
+        return decorator
+
+    @staticmethod
+    def _matches(route: Route, attributes: Dict) -> bool:
+        """
+        @cc 6
+        @desc check if the given message attributes satisfy a route
+        @arg route: the route to check
+        @arg attributes: the decoded message attributes of a job
+        @ret true if every match value and the predicate are satisfied
+        """
+        for name, expected in route.match.items():
+            if name not in attributes:
+                return False
+            if isinstance(expected, (tuple, list, set, frozenset)):
+                if attributes[name] not in expected:
+                    return False
+            elif attributes[name] != expected:
+                return False
+        return route.predicate is None or bool(route.predicate(attributes))
+
+    def match(self, job: Any) -> Optional[Callable]:
+        """
+        @cc 3
+        @desc find the handler for a job, looking only at its message attributes
+        @arg job: the qoo Job to find a handler for
+        @ret the first matching handler, or none if the job should be skipped
+        """
+        for route in self.routes:
+            if self._matches(route, job.message_attributes):
+                return route.handler
+        return None
+
+    def dispatch(self, job: Any) -> bool:
+        """
+        @cc 4
+        @desc pass a job to its handler, or skip it if no route matches
+        @arg job: the qoo Job to dispatch
+        @ret true if the job was handled
+        @note skipped jobs are left in the queue unless drop_unmatched is set
+        @note if the handler raises, the error is re-raised and the job is not deleted
+        """
+        handler = self.match(job)
+        if handler is None:
+            if self.drop_unmatched:
+                job.delete()
+            return False
+        handler(job)
+        if self.auto_delete:
+            job.delete()
+        return True
+
+    def dispatch_all(self, jobs: Iterable[Any]) -> List[Any]:
+        """
+        @cc 4
+        @desc dispatch each of the given jobs
+        @arg jobs: the qoo Jobs to dispatch
+        @ret the jobs that were handled
+        @note a handler that raises is logged and its job is not deleted, so it will be
+            redelivered after its visibility timeout; the remaining jobs are still dispatched
+        """
+        handled = []
+        for job in jobs:
+            try:
+                if self.dispatch(job):
+                    handled.append(job)
+            except Exception:
+                LOG.exception("failed to handle %s", job)
+        return handled
+
+    def __call__(self, job: Any) -> bool:
+        """
+        @cc 1
+        @desc allow a router to be used anywhere a job handler is expected
+        @arg job: the qoo Job to dispatch
+        @ret true if the job was handled
+        """
+        return self.dispatch(job)
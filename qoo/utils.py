@@ -6,16 +6,29 @@ import datetime
 import json
 import re
 import uuid
-from typing import Any, Iterator, List, Mapping
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional
 
 
 FIRST_CAP = re.compile("(.)([A-Z][a-z]+)")
 ALL_CAP = re.compile("([a-z0-9])([A-Z])")
+BOOLEAN = "String.boolean"
 
-# this allows us to use datetime in json dumps
-json.JSONEncoder.default = lambda self, obj: (  # type: ignore
-    obj.isoformat() if isinstance(obj, datetime.datetime) else None
-)
+
+class QooJSONEncoder(json.JSONEncoder):
+    """
+    @desc json encoder that also supports datetimes, used for qoo's own dumps
+    """
+
+    def default(self, o: Any) -> Any:  # pylint: disable=method-hidden
+        """
+        @cc 2
+        @desc encode datetimes and dates as iso formatted strings
+        @arg o: the object that json could not encode by default
+        @ret a json encodable version of the object
+        """
+        if isinstance(o, datetime.date):
+            return o.isoformat()
+        return json.JSONEncoder.default(self, o)
 
 
 def new_uuid() -> str:
@@ -40,10 +53,11 @@ def jsonl(json_string: str) -> Mapping:
 def jsond(obj: Mapping, **kwargs: Any) -> str:
     """
     @cc 1
-    @desc performs a json dump with our given patch
+    @desc performs a json dump with support for datetimes
     @arg obj: the dict/list to dump into a string
     @ret a json encoded string
     """
+    kwargs.setdefault("cls", QooJSONEncoder)
     return json.dumps(obj, **kwargs)
 
 
@@ -57,3 +71,89 @@ def chunk(items: List, size: int = 10) -> Iterator[List]:
     """
     for index in range(0, len(items), size):
         yield items[index : index + size]
+
+
+def ichunk(
+    items: Iterable,
+    size: int = 10,
+    max_bytes: int = 0,
+    measure: Optional[Callable[[Any], int]] = None,
+) -> Iterator[List]:
+    """
+    @cc 7
+    @desc lazily chunk any iterable into lists of a certain size, and optionally byte total
+    @arg items: an iterable of items to chunk, which is only consumed as needed
+    @arg size: the max size of the chunked lists
+    @arg max_bytes: if set, start a new chunk before one would exceed this many bytes
+    @arg measure: how to get the bytes of an item, defaulting to its utf-8 encoded length
+    @ret an iterator of lists
+    @note a single item larger than max_bytes is still yielded, in a chunk of its own
+    """
+    measure = measure or (lambda x: len(x.encode("utf-8")))
+    batch = []  # type: List
+    batch_bytes = 0
+    for item in items:
+        item_bytes = measure(item) if max_bytes else 0
+        if batch and max_bytes and batch_bytes + item_bytes > max_bytes:
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += item_bytes
+        if len(batch) >= size:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+
+def encode_message_attributes(attributes: Mapping) -> Dict:
+    """
+    @cc 7
+    @desc convert a mapping of python values into typed SQS message attributes
+    @arg attributes: a mapping of attribute names to str, int, float, bool, or bytes values
+    @ret a dict of SQS MessageAttributes
+    @note values that are already SQS attribute dicts (with a DataType) are passed as-is
+    """
+    encoded = {}
+    for name, value in attributes.items():
+        if isinstance(value, Mapping) and "DataType" in value:
+            encoded[name] = dict(value)
+        elif isinstance(value, bool):
+            encoded[name] = {"DataType": BOOLEAN, "StringValue": str(value).lower()}
+        elif isinstance(value, (int, float)):
+            encoded[name] = {"DataType": "Number", "StringValue": str(value)}
+        elif isinstance(value, str):
+            encoded[name] = {"DataType": "String", "StringValue": value}
+        elif isinstance(value, bytes):
+            encoded[name] = {"DataType": "Binary", "BinaryValue": value}
+        else:
+            raise TypeError(
+                "unsupported message attribute type for {}: {}".format(
+                    name, type(value).__name__
+                )
+            )
+    return encoded
+
+
+def decode_message_attributes(attributes: Mapping) -> Dict:
+    """
+    @cc 6
+    @desc convert typed SQS message attributes back into python values
+    @arg attributes: the MessageAttributes of a received SQS message
+    @ret a dict of attribute names to python values
+    """
+    decoded = {}  # type: Dict[str, Any]
+    for name, value in attributes.items():
+        data_type = value["DataType"]
+        if data_type == BOOLEAN:
+            decoded[name] = value["StringValue"] == "true"
+        elif data_type.startswith("Number"):
+            try:
+                decoded[name] = int(value["StringValue"])
+            except ValueError:
+                decoded[name] = float(value["StringValue"])
+        elif data_type.startswith("Binary"):
+            decoded[name] = value["BinaryValue"]
+        else:
+            decoded[name] = value["StringValue"]
+    return decoded
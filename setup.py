@@ -24,6 +24,7 @@ setup(
     license="MIT",
     packages=["qoo"],
     install_requires=REQUIRED,
+    entry_points={"console_scripts": ["qoo=qoo.cli:main"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "Programming Language :: Python :: 3.5",
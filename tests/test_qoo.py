@@ -2,13 +2,18 @@
 @author jacobi petrucciani
 @desc pytest the qoo functionality
 """
+import datetime
 import json
 import os
 import pytest
 import qoo
+import subprocess
 import sys
+import threading
 import time
 from moto import mock_sqs
+from qoo import cli
+from qoo.utils import ichunk, jsond
 
 
 def dbg(text) -> None:
@@ -34,6 +39,30 @@ def test_login():
     assert os.environ["AWS_DEFAULT_REGION"] == "us-east-1"
 
 
+def test_import_is_fast_and_lazy():
+    """benchmark importing qoo in a fresh interpreter, ensuring boto3 is not loaded"""
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import qoo\n"
+        "elapsed = time.perf_counter() - start\n"
+        "assert not [x for x in sys.modules if x.startswith(('boto3', 'botocore'))]\n"
+        "print(elapsed)\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", script])
+    elapsed = float(output.decode().strip())
+    dbg("import qoo took {:.1f}ms".format(elapsed * 1000))
+    assert elapsed < 0.25
+
+
+def test_datetime_json_support_is_scoped():
+    """test that datetimes can be dumped by qoo without patching the json module"""
+    now = datetime.datetime(2020, 1, 2, 3, 4, 5)
+    assert jsond({"at": now}) == '{"at": "2020-01-02T03:04:05"}'
+    with pytest.raises(TypeError):
+        json.dumps({"at": now})
+
+
 @mock_sqs
 def test_queues_can_be_created():
     """test that we can create a queue"""
@@ -164,3 +193,416 @@ def test_pull_two_jobs(queue_with_jobs):
     assert job_1.test
     assert job_0.test == "test message 0"
     assert job_1.test == "test message 1"
+
+
+@mock_sqs
+def test_dedup_skips_redelivered_jobs():
+    """test that a redelivered job that was already processed is acked and skipped"""
+    qoo.create("dedup_queue", visibility_timeout=0)
+    dedup = qoo.DedupCache(max_size=10)
+    queue = qoo.get("dedup_queue", dedup=dedup)
+    queue.send(info="test_job")
+    job = queue.receive(wait_time=1)
+    assert job
+    assert not dedup.seen(job)
+
+    # processed, but the delete was lost; simulate by only marking it
+    dedup.add(job)
+    assert not queue.receive(wait_time=1)
+    assert len(queue) == 0
+
+
+@mock_sqs
+def test_dedup_by_md5(tmp_path):
+    """test that duplicate bodies are skipped with a shared sqlite dedup cache"""
+    qoo.create("dedup_queue")
+    dedup = qoo.SQLiteDedupCache(str(tmp_path / "dedup.db"), key="md5")
+    queue = qoo.get("dedup_queue", dedup=dedup)
+    queue.send(info="same")
+    queue.send(info="same")
+    job = queue.receive(wait_time=1)
+    job.delete()
+    assert job._md5 in dedup
+    assert job._id not in dedup
+    assert not queue.receive(wait_time=1)
+    assert len(queue) == 0
+
+
+@mock_sqs
+def test_dedup_keeps_fresh_jobs_when_acking_a_duplicate_fails(monkeypatch):
+    """test that a failed delete of a duplicate does not lose the rest of the batch"""
+    qoo.create("dedup_queue", visibility_timeout=0)
+    dedup = qoo.DedupCache(key="md5")
+    queue = qoo.get("dedup_queue", dedup=dedup)
+    queue.send(info="duplicate")
+    queue.send(info="fresh")
+    dedup.add_key(queue.receive_jobs(max_messages=1, wait_time=1)[0]._md5)
+
+    def failing_delete(handle):
+        raise RuntimeError("throttled")
+
+    monkeypatch.setattr(queue, "delete_job", failing_delete)
+    jobs = queue.receive_jobs(max_messages=10, wait_time=1)
+    assert [x.info for x in jobs] == ["fresh"]
+
+
+def test_dedup_cache_is_bounded(tmp_path, monkeypatch):
+    """test that the dedup caches evict the oldest and expired keys"""
+    dedup = qoo.DedupCache(max_size=2)
+    for key in ("a", "b", "c"):
+        dedup.add_key(key)
+    assert len(dedup) == 2
+    assert "a" not in dedup
+    assert "c" in dedup
+
+    shared = qoo.SQLiteDedupCache(str(tmp_path / "dedup.db"), max_size=2)
+    for key in ("a", "b", "c"):
+        shared.add_key(key)
+    assert len(shared) == 2
+    assert "a" not in shared
+    assert "c" in shared
+
+    # keys added within the same clock tick are evicted oldest first, one at a time
+    tied = qoo.SQLiteDedupCache(str(tmp_path / "tied.db"), max_size=2)
+    monkeypatch.setattr(qoo.dedup.time, "time", lambda: 1000.0)
+    for key in ("a", "b", "c"):
+        tied.add_key(key)
+    assert len(tied) == 2
+    assert "a" not in tied
+    assert "b" in tied
+    assert "c" in tied
+
+    expiring = qoo.DedupCache(ttl=-1)
+    expiring.add_key("a")
+    assert "a" not in expiring
+    with pytest.raises(ValueError):
+        qoo.DedupCache(key="body")
+
+
+def test_ichunk_is_lazy():
+    """test that ichunk chunks an iterator without consuming it all up front"""
+    numbers = iter(range(25))
+    chunks = ichunk(numbers, size=10)
+    assert next(chunks) == list(range(10))
+    assert next(numbers) == 10
+    assert [len(x) for x in chunks] == [10, 4]
+    assert list(ichunk(["aaa", "bb", "c", "dddd", "e"], size=3, max_bytes=4)) == [
+        ["aaa"],
+        ["bb", "c"],
+        ["dddd"],
+        ["e"],
+    ]
+
+
+def test_cli_send_reports_failed_batches(queue, tmp_path, capsys, monkeypatch):
+    """test that a batch send that raises is counted as failed without stopping the send"""
+    ndjson = tmp_path / "jobs.ndjson"
+    ndjson.write_text("\n".join(json.dumps({"job": x}) for x in range(25)))
+    send_batch = qoo.Queue.send_batch
+
+    def flaky_send_batch(self, raw_jobs, **kwargs):
+        if json.loads(raw_jobs[0]["MessageBody"])["job"] == 10:
+            raise RuntimeError("throttled")
+        return send_batch(self, raw_jobs, **kwargs)
+
+    monkeypatch.setattr(qoo.Queue, "send_batch", flaky_send_batch)
+    assert cli.main(["send", "qoo", str(ndjson), "--concurrency", "1"]) == 1
+    err = capsys.readouterr().err
+    assert "sent 15 messages, 10 failed" in err
+    assert "failed: line 11: RuntimeError('throttled')" in err
+    assert "failed: line 20: RuntimeError('throttled')" in err
+    assert '"job"' not in err
+    assert len(queue) == 15
+
+
+def test_cli_send_splits_batches_by_bytes(queue, tmp_path, capsys):
+    """test that large lines are split into batches under the SQS batch size limit"""
+    ndjson = tmp_path / "jobs.ndjson"
+    ndjson.write_text(
+        "\n".join(json.dumps({"job": x, "data": "x" * 30000}) for x in range(20))
+    )
+    assert cli.main(["send", "qoo", str(ndjson)]) == 0
+    assert "sent 20 messages, 0 failed" in capsys.readouterr().err
+    assert len(queue) == 20
+
+
+def test_cli_send_tail_stats_and_purge(queue, tmp_path, capsys, monkeypatch):
+    """test the qoo cli commands against a queue"""
+    ndjson = tmp_path / "jobs.ndjson"
+    ndjson.write_text(
+        "\n".join(json.dumps({"job": x}) for x in range(25)) + "\n\n",
+    )
+    assert cli.main(["send", "qoo", str(ndjson), "--concurrency", "2"]) == 0
+    assert "sent 25 messages, 0 failed" in capsys.readouterr().err
+    assert len(queue) == 25
+
+    assert cli.main(["tail", "qoo", "-n", "12", "--delete", "-w", "1"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 12
+    printed = {json.loads(x)["job"] for x in lines}
+    assert len(printed) == 12
+    assert printed <= set(range(25))
+    assert len(queue) == 13
+
+    assert cli.main(["stats", "qoo", "-n", "1"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1].split() == ["qoo", "13", "0", "0"]
+
+    monkeypatch.setattr("builtins.input", lambda prompt: "n")
+    assert cli.main(["purge", "qoo"]) == 1
+    assert len(queue) == 13
+    assert cli.main(["purge", "qoo", "--yes"]) == 0
+    assert len(queue) == 0
+
+
+def test_message_attributes_round_trip(queue):
+    """test that typed message attributes can be sent and are exposed on jobs"""
+    queue.send_job(
+        message_attributes={"kind": "email", "priority": 3, "ratio": 0.5, "urgent": True},
+        info="test_job",
+    )
+    queue.send_batch([{"job": 0}], message_attributes={"kind": "sms", "raw": b"\x00"})
+    job = queue.receive(wait_time=1)
+    assert job.message_attributes == {
+        "kind": "email",
+        "priority": 3,
+        "ratio": 0.5,
+        "urgent": True,
+    }
+    assert not job._decoded
+    assert job.info == "test_job"
+    assert job._decoded
+    job = queue.receive(wait_time=1)
+    assert job.message_attributes == {"kind": "sms", "raw": b"\x00"}
+    assert "job" in job
+    queue.send_batch(
+        [
+            {
+                "Id": "raw",
+                "MessageBody": "{}",
+                "MessageAttributes": {
+                    "kind": {"DataType": "String", "StringValue": "push"}
+                },
+            }
+        ],
+        auto_metadata=False,
+        message_attributes={"kind": "sms", "priority": 1},
+    )
+    job = queue.receive(wait_time=1)
+    assert job.message_attributes == {"kind": "push", "priority": 1}
+    with pytest.raises(TypeError):
+        queue.send_job(message_attributes={"bad": object()})
+
+
+def test_body_keys_do_not_clobber_job_metadata(queue):
+    """test that lazily decoded body keys never overwrite the job's own attributes"""
+    queue.send_job(elapsed="x", _deleted=True, delete="x", info=1)
+    job = queue.receive(wait_time=1)
+    elapsed = job.elapsed
+    assert job.info == 1
+    assert job.elapsed == elapsed
+    assert job._deleted is False
+    assert callable(job.delete)
+    assert job._body["elapsed"] == "x"
+
+
+def test_router_dispatches_on_attributes(queue):
+    """test that the router only decodes and handles jobs matching its routes"""
+    router = qoo.Router()
+    handled = []
+
+    @router.route({"kind": ("email", "sms")}, predicate=lambda x: x["priority"] > 1)
+    def handle(job):
+        handled.append(job.info)
+
+    for kind, priority in (("email", 2), ("push", 2), ("sms", 1), ("sms", 5)):
+        queue.send_job(
+            message_attributes={"kind": kind, "priority": priority},
+            info="{} {}".format(kind, priority),
+        )
+    jobs = queue.receive_jobs(max_messages=10, wait_time=1)
+    assert len(router.dispatch_all(jobs)) == 2
+    assert handled == ["email 2", "sms 5"]
+    assert [x._decoded for x in jobs] == [True, False, False, True]
+    assert len(queue) == 0
+    assert queue.approx_not_visible == 2
+
+
+def test_router_dispatch_all_survives_failing_handlers(queue):
+    """test that a handler raising does not stop the rest of the batch being dispatched"""
+    router = qoo.Router()
+
+    @router.route()
+    def handle(job):
+        if job.job == 1:
+            raise RuntimeError("bad job")
+
+    queue.send_batch([{"job": x} for x in range(3)])
+    jobs = queue.receive_jobs(max_messages=10, wait_time=1)
+    handled = router.dispatch_all(jobs)
+    assert sorted(x.job for x in handled) == [0, 2]
+    assert [x._deleted for x in jobs if x.job == 1] == [False]
+    assert queue.latency_report()["deleted"] == 2
+
+
+def test_router_matches_any_attribute_name(queue):
+    """test that attributes sharing a name with router arguments can still be matched"""
+    router = qoo.Router()
+    handled = []
+    router.add(handled.append, {"handler": "a", "predicate": "b"})
+    queue.send_job(message_attributes={"handler": "a", "predicate": "b"}, info=1)
+    queue.send_job(message_attributes={"handler": "a"}, info=2)
+    router.dispatch_all(queue.receive_jobs(max_messages=10, wait_time=1))
+    assert [x.info for x in handled] == [1]
+
+
+def test_sketch_percentiles_are_accurate_and_bounded():
+    """test that the sketch estimates percentiles within its accuracy using bounded memory"""
+    sketch = qoo.Sketch(relative_accuracy=0.01, max_buckets=128)
+    assert sketch.summary() == {"count": 0}
+    for value in range(1, 100001):
+        sketch.add(value / 1000)
+    summary = sketch.summary()
+    assert summary["count"] == 100000
+    assert summary["min"] == 0.001
+    assert summary["max"] == 100.0
+    assert summary["p50"] == pytest.approx(50.0, rel=0.02)
+    assert summary["p99"] == pytest.approx(99.0, rel=0.02)
+    assert len(sketch._buckets) <= 128
+    sketch.add(-1.0)
+    assert sketch.quantile(0.0) == 0.0
+
+
+def test_queue_latency_report(queue):
+    """test that the queue tracks receive latency, processing time and redeliveries"""
+    assert queue.latency_report()["received"] == 0
+    queue.send_batch([{"job": x} for x in range(5)])
+    jobs = queue.receive_jobs(max_messages=10, wait_time=1)
+    for job in jobs[:3]:
+        job.delete()
+    report = queue.latency_report()
+    assert report["received"] == 5
+    assert report["deleted"] == 3
+    assert report["redelivered"] == 0
+    assert report["oldest_message_age"] == report["receive_latency"]["max"]
+    assert report["oldest_message_seen_at"] <= time.time()
+    assert report["processing_time"]["p50"] >= 0.0
+    assert report["receive_count"]["max"] == 1
+
+    # the gauge follows the latest receive, dropping once the queue is empty
+    assert not queue.receive_jobs(wait_time=1)
+    report = queue.latency_report()
+    assert report["oldest_message_age"] == 0.0
+    assert report["receive_latency"]["count"] == 5
+    queue.reset_latency()
+    assert queue.latency_report()["deleted"] == 0
+    assert queue.latency_report()["oldest_message_age"] is None
+
+
+def test_autoscaling_decisions(queue):
+    """test that the autoscaler scales on backlog, with cooldowns and hysteresis"""
+    consumer = qoo.AutoscalingConsumer(
+        queue,
+        lambda job: None,
+        min_workers=1,
+        max_workers=8,
+        target_drain_time=10.0,
+        scale_up_cooldown=30.0,
+        scale_down_cooldown=60.0,
+    )
+    consumer._workers = [(None, None)] * 2
+    consumer._last_scaled_at = 0.0
+
+    # no rate measured yet, so step up by one
+    assert consumer._decide(100, 0, 100.0).scale == 3
+    assert consumer._decide(100, 0, 10.0).scale == 2
+    assert "scale up cooldown" in consumer._decide(100, 0, 10.0).reason
+
+    # 1 job/s per worker, 50 messages to drain in 10s needs 5 workers, capped at 8
+    consumer._job_seconds = 1.0
+    assert consumer._decide(50, 0, 100.0).scale == 5
+    assert consumer._decide(500, 0, 100.0).scale == 8
+
+    # our own in-flight jobs are not counted as backlog
+    consumer._in_flight = 20
+    assert consumer._decide(0, 20, 100.0).scale == 1
+    consumer._in_flight = 0
+
+    # small drops are held by hysteresis, larger ones by the scale down cooldown
+    consumer._workers = [(None, None)] * 8
+    assert "hysteresis" in consumer._decide(65, 0, 100.0).reason
+    assert consumer._decide(65, 0, 100.0).scale == 8
+    assert "scale down cooldown" in consumer._decide(10, 0, 50.0).reason
+    assert consumer._decide(10, 0, 100.0).scale == 1
+
+
+@mock_sqs
+def test_autoscaling_consumer_drains_queue():
+    """test that the autoscaling consumer processes and deletes all jobs"""
+    qoo.create("autoscale_queue")
+    queue = qoo.get("autoscale_queue", wait_time=1)
+    queue.send_batch([{"job": x} for x in range(30)])
+    handled = []
+    consumer = qoo.AutoscalingConsumer(
+        queue,
+        lambda job: handled.append(job.job),
+        max_workers=3,
+        interval=0.05,
+        scale_up_cooldown=0.0,
+        scale_down_cooldown=0.0,
+    )
+    with consumer:
+        deadline = time.time() + 10
+        while consumer.processed < 30 and time.time() < deadline:
+            time.sleep(0.05)
+    assert sorted(handled) == list(range(30))
+    assert consumer.failed == 0
+    assert consumer.scale == 0
+    assert consumer.decisions[0].reason == "started with min_workers"
+    assert consumer.job_rate
+    assert len(queue) == 0
+    assert queue.approx_not_visible == 0
+
+
+class SlowQueue:
+    """stub queue whose attribute refresh is slow, to race stop against the controller"""
+
+    approx_messages = 100
+    approx_not_visible = 0
+
+    def _update_attributes(self):
+        time.sleep(0.2)
+
+    def receive_jobs(self, **kwargs):
+        time.sleep(0.3)
+        return []
+
+
+def test_autoscaling_consumer_stop_waits_for_controller():
+    """test that a scaling check in progress cannot start workers after stop"""
+    consumer = qoo.AutoscalingConsumer(
+        SlowQueue(),
+        lambda job: None,
+        min_workers=0,
+        interval=0.01,
+        scale_up_cooldown=0.0,
+    )
+    consumer.start()
+    time.sleep(0.1)
+    consumer.stop()
+    assert consumer.scale == 0
+    time.sleep(0.1)
+    assert consumer.scale == 0
+    assert not [x for x in threading.enumerate() if x.name.startswith("qoo-worker")]
+
+
+def test_autoscaling_consumer_stop_joins_retired_workers():
+    """test that workers retired by a scale down are still waited on by stop"""
+    consumer = qoo.AutoscalingConsumer(SlowQueue(), lambda job: None, min_workers=2)
+    consumer.start()
+    workers = [x for x, _ in consumer._workers]
+    consumer._set_scale(0, "test scale down")
+    assert consumer.scale == 0
+    consumer.stop()
+    assert not [x for x in workers if x.is_alive()]
+    assert consumer.last_decision.reason == "test scale down"